@@ -1,4 +1,5 @@
 import csv
+import functools
 import json
 import os
 import sys
@@ -17,7 +18,8 @@ client = AzureOpenAI(
     api_key=os.getenv("AZURE_OPENAI_API_KEY"),
 )
 
-# 加载系统提示词/指令
+# 加载系统提示词/指令（只读取一次，保证每次请求的指令文本完全一致）
+@functools.lru_cache(maxsize=1)
 def load_instructions() -> str:
     instructions_path = Path(__file__).with_name("instructions.txt")
     return instructions_path.read_text(encoding="utf-8").strip()
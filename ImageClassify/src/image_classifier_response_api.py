@@ -1,35 +1,167 @@
+import atexit
 import csv
+import functools
+import hashlib
 import json
+import logging
 import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Dict, List
+from typing import Any, Dict, List, Optional
+import httpx
+from diskcache import Cache
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import AzureOpenAI, DefaultHttpxClient, RateLimitError
+from openai.types.responses import Response
 
 # 加载环境变量
 load_dotenv()
 
+# 设置日志：逐行处理信息使用 DEBUG 级别，避免并发时大量输出阻塞工作线程
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 批处理时每完成多少张图片输出一次进度
+PROGRESS_INTERVAL = 50
+
+# 共享 HTTP 连接池：放宽连接数上限并启用 HTTP/2，并发批处理时复用连接，避免重复 TCP/TLS 握手
+http_client = DefaultHttpxClient(
+    limits=httpx.Limits(max_connections=256, max_keepalive_connections=128),
+    http2=True,
+    timeout=httpx.Timeout(60.0, connect=10.0),
+)
+atexit.register(http_client.close)
+
 # 初始化客户端
 client = AzureOpenAI(
     azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
     api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
     api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+    http_client=http_client,
+)
+
+# 单张图片请求的预估 token 消耗，用于 TPM 限流
+ESTIMATED_TOKENS_PER_IMAGE = 1500
+
+# 基于令牌桶的客户端限流器，按部署的 RPM/TPM 配额为并发请求匀速放行
+class RateLimiter:
+    def __init__(self, rpm: int, tpm: int) -> None:
+        self.rpm = rpm
+        self.tpm = tpm
+        self.rpm_bucket = float(rpm)
+        self.tpm_bucket = float(tpm)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        if self.rpm:
+            self.rpm_bucket = min(self.rpm, self.rpm_bucket + elapsed * self.rpm / 60)
+        if self.tpm:
+            self.tpm_bucket = min(self.tpm, self.tpm_bucket + elapsed * self.tpm / 60)
+
+    # 阻塞直到桶内有足够的请求数和 token 配额
+    def acquire(self, tokens: int) -> None:
+        if not self.rpm and not self.tpm:
+            return
+        while True:
+            with self.lock:
+                self._refill()
+                rpm_ok = not self.rpm or self.rpm_bucket >= 1
+                tpm_ok = not self.tpm or self.tpm_bucket >= min(tokens, self.tpm)
+                if rpm_ok and tpm_ok:
+                    if self.rpm:
+                        self.rpm_bucket -= 1
+                    if self.tpm:
+                        self.tpm_bucket -= tokens
+                    return
+                wait = 0.0
+                if not rpm_ok:
+                    wait = max(wait, (1 - self.rpm_bucket) * 60 / self.rpm)
+                if not tpm_ok:
+                    wait = max(wait, (min(tokens, self.tpm) - self.tpm_bucket) * 60 / self.tpm)
+            time.sleep(wait)
+
+    # 收到 429 时按 retry-after 扣减配额，使所有线程一起退避
+    def penalize(self, retry_after: float) -> None:
+        with self.lock:
+            self._refill()
+            if self.rpm:
+                self.rpm_bucket -= retry_after * self.rpm / 60
+            if self.tpm:
+                self.tpm_bucket -= retry_after * self.tpm / 60
+
+# 所有工作线程共享同一个限流器
+limiter = RateLimiter(
+    rpm=int(os.getenv("AZURE_RPM", "0")),
+    tpm=int(os.getenv("AZURE_TPM", "0")),
 )
 
-# 加载系统提示词/指令
+# 从 429 响应头中解析 retry-after 秒数
+def parse_retry_after(error: RateLimitError) -> float:
+    try:
+        return float(error.response.headers.get("retry-after", "1"))
+    except (AttributeError, ValueError):
+        return 1.0
+
+# 加载系统提示词/指令（只读取一次，保证每次请求的指令文本完全一致）
+@functools.lru_cache(maxsize=1)
 def load_instructions() -> str:
     instructions_path = Path(__file__).with_name("instructions.txt")
     return instructions_path.read_text(encoding="utf-8").strip()
 
-# 从 GPT 响应中提取分类结果
-def extract_result_from_response(response: Dict) -> str:
+# Azure 提示缓存要求请求前缀至少 1024 个 token 且逐字节一致
+PROMPT_CACHE_KEY = "shein_test_0814"
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+# 在导入时固定请求前缀，避免每次调用之间出现差异导致缓存失效
+_MODEL = os.getenv("AZURE_OPENAI_DEPLOYMENT")
+_INSTRUCTIONS = load_instructions()
+_REASONING = {"effort": os.getenv("REASONING_EFFORT"), "summary": os.getenv("REASONING_SUMMARY")}
+
+# 统计指令的 token 数，未安装 tiktoken 时返回 None
+def count_instruction_tokens(text: str) -> Optional[int]:
     try:
-        for item in response.get('output', []):
-            if item.get('type') == 'message' and item.get('role') == 'assistant':
-                for content_item in item.get('content', []):
-                    if content_item.get('type') == 'output_text':
-                        text = content_item.get('text', '').strip()
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        encoding = tiktoken.encoding_for_model(_MODEL or "")
+    except KeyError:
+        encoding = tiktoken.get_encoding("o200k_base")
+    return len(encoding.encode(text))
+
+_INSTRUCTION_TOKENS = count_instruction_tokens(_INSTRUCTIONS)
+if _INSTRUCTION_TOKENS is not None and _INSTRUCTION_TOKENS < PROMPT_CACHE_MIN_TOKENS:
+    logger.warning(
+        f"Instructions are {_INSTRUCTION_TOKENS} tokens, below the "
+        f"{PROMPT_CACHE_MIN_TOKENS}-token prompt cache threshold"
+    )
+
+# 本地响应缓存：相同模型、指令和图片 URL 的请求直接复用之前的结果，使用 --no-cache 关闭（此时不创建缓存目录）
+_CACHE_ENABLED = "--no-cache" not in sys.argv
+_cache = Cache(Path(__file__).parent.parent / ".cache") if _CACHE_ENABLED else None
+_INSTR_HASH = hashlib.sha256(_INSTRUCTIONS.encode("utf-8")).hexdigest()
+
+# 生成响应缓存的键
+def response_cache_key(url: str) -> str:
+    return hashlib.sha256(
+        f"{_MODEL}|{_INSTR_HASH}|{_REASONING['effort']}|{url}".encode("utf-8")
+    ).hexdigest()
+
+# 从 GPT 响应中提取分类结果（直接读取响应对象属性，避免 model_dump 序列化整个响应）
+def extract_result_from_response(response: Any) -> str:
+    try:
+        for item in getattr(response, 'output', None) or []:
+            if item.type == 'message' and item.role == 'assistant':
+                for content_item in item.content or []:
+                    if content_item.type == 'output_text':
+                        text = (content_item.text or '').strip()
                         try:
                             result_json = json.loads(text)
                             return result_json.get('result', '无')
@@ -40,13 +172,20 @@ def extract_result_from_response(response: Dict) -> str:
         return '无'
 
 # 调用 Azure OpenAI 进行图像分类
-def invoke_azure_openai(url: str) -> Dict:
+def invoke_azure_openai(url: str) -> Response:
+    key = response_cache_key(url)
+    if _CACHE_ENABLED:
+        cached = _cache.get(key)
+        if cached is not None:
+            return Response.model_validate_json(cached)
+    
+    limiter.acquire(ESTIMATED_TOKENS_PER_IMAGE)
     try:
         response = client.responses.create(
-            model=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
-            prompt_cache_key="shein_test_0814",
-            instructions=load_instructions(),
-            reasoning={"effort": os.getenv("REASONING_EFFORT"), "summary": os.getenv("REASONING_SUMMARY")},
+            model=_MODEL,
+            prompt_cache_key=PROMPT_CACHE_KEY,
+            instructions=_INSTRUCTIONS,
+            reasoning=_REASONING,
             input=[{
                 "role": "user",
                 "content": [
@@ -55,37 +194,44 @@ def invoke_azure_openai(url: str) -> Dict:
             }],
             
         )
+        if _CACHE_ENABLED:
+            _cache.set(key, response.model_dump_json())
         return response
+    except RateLimitError as e:
+        limiter.penalize(parse_retry_after(e))
+        raise e
     except Exception as e:
-        if len(sys.argv) <= 1 or sys.argv[1] != "--batch":
+        if "--batch" not in sys.argv:
             if "Failed to load image" in str(e):
                 raise SystemExit("Failed to load image. Please check the URL")
         raise e
 
+# 详细结果最多保留的条数，避免大批量时占用过多内存
+DETAIL_SAMPLE_SIZE = 100
+
+# 判断检测结果是否与预期分类匹配
+def is_match(expected: str, detected: str) -> bool:
+    if detected == "Failed":
+        return False
+    return expected in detected
+
 # 计算并显示分类准确率和详细结果
-def calculate_and_display_accuracy(results: List[Dict]) -> None:
-    valid_results = [r for r in results if r['result'] != "Failed"]
+def calculate_and_display_accuracy(tally: Dict[str, int], samples: List[Dict]) -> None:
+    print(f"Successfully processed: {tally['ok']} images")
+    print(f"Failed to process: {tally['fail']} images")
     
-    def is_match(expected: str, detected: str) -> bool:
-        if detected == "Failed":
-            return False
-        return expected in detected
-    
-    correct = sum(1 for r in valid_results if is_match(r['tags'], r['result']))
-    failed_count = len(results) - len(valid_results)
-    
-    print(f"Successfully processed: {len(valid_results)} images")
-    print(f"Failed to process: {failed_count} images")
-    
-    if valid_results:
-        accuracy = correct / len(valid_results) * 100
-        print(f"Accuracy: {correct}/{len(valid_results)} ({accuracy:.1f}%)")
+    if tally['ok']:
+        accuracy = tally['correct'] / tally['ok'] * 100
+        print(f"Accuracy: {tally['correct']}/{tally['ok']} ({accuracy:.1f}%)")
         
         print("\nDetailed Results:")
-        for result in results:
+        for result in samples:
             tags, detected = result['tags'], result['result']
             status = "✓" if is_match(tags, detected) else "✗"
             print(f"  {status} Expected: {tags} | Detected: {detected}")
+        omitted = tally['ok'] + tally['fail'] - len(samples)
+        if omitted > 0:
+            print(f"  ... {omitted} more in results file")
     else:
         print("No valid results to calculate accuracy.")
 
@@ -98,6 +244,7 @@ def process_single_image(url: str) -> None:
         print("Usage:")
         print("  Single image: python src/call_gpt_5_nano.py <image_url>")
         print("  Batch process: python src/call_gpt_5_nano.py --batch")
+        print("  Add --no-cache to bypass the local response cache")
         print("  Or set IMAGE_URL environment variable")
         sys.exit(1)
 
@@ -114,50 +261,88 @@ def process_csv_batch() -> None:
     if not samples_path.exists():
         raise SystemExit(f"Input file not found: {samples_path}")
     
-    results = []
-    
+    # 只用到 tags 和 image_url 两列，按列下标读取，避免为每行构造字典
     with open(samples_path, 'r', encoding='utf-8-sig') as f:
-        reader = csv.DictReader(f)
+        reader = csv.reader(f)
+        header = next(reader, [])
+        if 'image_url' not in header:
+            raise SystemExit(f"Column 'image_url' not found in: {samples_path}")
+        tags_index = header.index('tags') if 'tags' in header else None
+        url_index = header.index('image_url')
+        
+        rows = []
         for row in reader:
-            tags, image_url = row.get('tags', ''), row.get('image_url', '')
-            
+            image_url = row[url_index] if url_index < len(row) else ''
             if not image_url:
-                print(f"Skipping row with empty image_url: {row}")
+                logger.warning(f"Skipping row with empty image_url: {row}")
                 continue
-                
-            print(f"Processing: {image_url}")
-            
+            tags = row[tags_index] if tags_index is not None and tags_index < len(row) else ''
+            rows.append((tags, image_url))
+
+    # 并发调用 Azure OpenAI，结果按原始行顺序逐行写入，只缓存乱序完成的行
+    tally = {"ok": 0, "fail": 0, "correct": 0}
+    samples = []
+    pending = {}
+    next_index = 0
+    max_workers = int(os.getenv("CONCURRENCY", "8"))
+    with open(results_path, 'w', newline='', encoding='utf-8') as out, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        writer = csv.DictWriter(out, fieldnames=['tags', 'image_url', 'result'])
+        writer.writeheader()
+        out.flush()
+
+        futures = {
+            executor.submit(invoke_azure_openai, image_url): index
+            for index, (_, image_url) in enumerate(rows)
+        }
+        for future in as_completed(futures):
+            # 取出后不再持有已完成的 future，响应对象在写出结果后即可释放
+            index = futures.pop(future)
+            tags, image_url = rows[index]
             try:
-                response = invoke_azure_openai(image_url)
-                result = extract_result_from_response(response.model_dump())
-                print(f"Result: {result}\n")
+                response = future.result()
+                result = extract_result_from_response(response)
+                logger.debug(f"Processed: {image_url} -> {result}")
             except Exception as e:
-                print(f"Error: {e}\n")
+                logger.warning(f"Failed: {image_url}: {e}")
                 result = "Failed"
 
-            results.append({
+            if result == "Failed":
+                tally["fail"] += 1
+            else:
+                tally["ok"] += 1
+                tally["correct"] += is_match(tags, result)
+            
+            done = tally["ok"] + tally["fail"]
+            if done % PROGRESS_INTERVAL == 0 or done == len(rows):
+                logger.info(f"Progress: {done}/{len(rows)} images ({tally['fail']} failed)")
+
+            pending[index] = {
                 'tags': tags,
                 'image_url': image_url,
                 'result': result
-            })
-    
-    with open(results_path, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=['tags', 'image_url', 'result'])
-        writer.writeheader()
-        writer.writerows(results)
+            }
+            while next_index in pending:
+                record = pending.pop(next_index)
+                writer.writerow(record)
+                if len(samples) < DETAIL_SAMPLE_SIZE:
+                    samples.append(record)
+                next_index += 1
+            out.flush()
     
     print(f"\nProcessing Complete.")
     print(f"Results saved to: {results_path}")
-    print(f"Total processed: {len(results)} images")
+    print(f"Total processed: {len(rows)} images")
     
-    calculate_and_display_accuracy(results)
+    calculate_and_display_accuracy(tally, samples)
 
 # 主函数：根据参数选择处理模式
 def main() -> None:
-    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+    args = [arg for arg in sys.argv[1:] if arg != "--no-cache"]
+    if args and args[0] == "--batch":
         process_csv_batch()
     else:
-        image_url = sys.argv[1] if len(sys.argv) > 1 else None
+        image_url = args[0] if args else None
         process_single_image(image_url)
 
 if __name__ == "__main__":
@@ -5,15 +5,59 @@
 
 import os
 import glob
-import json
-from typing import List
-from shop_name_matcher import ShopNameMatcher
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional, Tuple
+from shop_name_matcher import ShopNameMatcher, load_json_file, dump_json_file, load_standard_names
 import argparse
 
+# 每个工作进程持有的匹配器实例
+_MATCHER: Optional[ShopNameMatcher] = None
+
+def _worker_init(csv_file: str, standard_shop_names: List[str], lev_threshold: float, jw_threshold: float) -> None:
+    """
+    工作进程初始化：用主进程已加载的标准店铺名称在每个进程中创建一次匹配器
+    
+    Args:
+        csv_file: 标准店铺名称CSV文件路径
+        standard_shop_names: 主进程加载的标准店铺名称列表
+        lev_threshold: Levenshtein相似度阈值
+        jw_threshold: Jaro-Winkler相似度阈值
+    """
+    global _MATCHER
+    _MATCHER = ShopNameMatcher(
+        csv_file=csv_file,
+        levenshtein_threshold=lev_threshold,
+        jaro_winkler_threshold=jw_threshold,
+        standard_shop_names=standard_shop_names
+    )
+
+def _worker_process(json_file: str, output_dir: str) -> Tuple[str, str]:
+    """
+    在工作进程中处理单个JSON文件
+    
+    Args:
+        json_file: 输入JSON文件路径
+        output_dir: 输出目录路径
+        
+    Returns:
+        元组 (输出文件路径, 报告文件路径)
+    """
+    name_without_ext = os.path.splitext(os.path.basename(json_file))[0]
+    output_file = os.path.join(output_dir, f"{name_without_ext}_matched.json")
+    report_file = os.path.join(output_dir, f"{name_without_ext}_report.json")
+    
+    _MATCHER.process_json_file(
+        input_json_file=json_file,
+        output_json_file=output_file,
+        report_file=report_file
+    )
+    return output_file, report_file
+
 def batch_process_files(input_dir: str, output_dir: str, csv_file: str, 
-                       lev_threshold: float = 0.8, jw_threshold: float = 0.85):
+                       lev_threshold: float = 0.8, jw_threshold: float = 0.85,
+                       max_workers: Optional[int] = None):
     """
-    批量处理目录中的所有JSON文件
+    批量处理目录中的所有JSON文件，多个文件在进程池中并行处理
     
     Args:
         input_dir: 输入目录路径
@@ -21,18 +65,12 @@ def batch_process_files(input_dir: str, output_dir: str, csv_file: str,
         csv_file: 标准店铺名称CSV文件路径
         lev_threshold: Levenshtein相似度阈值
         jw_threshold: Jaro-Winkler相似度阈值
+        max_workers: 工作进程数（默认使用CPU核心数）
     """
     
     # 创建输出目录
     os.makedirs(output_dir, exist_ok=True)
     
-    # 创建匹配器实例
-    matcher = ShopNameMatcher(
-        csv_file=csv_file,
-        levenshtein_threshold=lev_threshold,
-        jaro_winkler_threshold=jw_threshold
-    )
-    
     # 查找所有JSON文件
     json_files = glob.glob(os.path.join(input_dir, "*.json"))
     
@@ -42,29 +80,33 @@ def batch_process_files(input_dir: str, output_dir: str, csv_file: str,
     
     print(f"找到 {len(json_files)} 个JSON文件")
     
+    # 在主进程中加载标准店铺名称，CSV文件有问题时直接报错，而不是在每个工作进程初始化时失败
+    standard_shop_names = load_standard_names(csv_file)
+    
     total_replacements = 0
-    all_reports = []
+    reports = [None] * len(json_files)
     
-    for json_file in json_files:
-        filename = os.path.basename(json_file)
-        name_without_ext = os.path.splitext(filename)[0]
-        
-        output_file = os.path.join(output_dir, f"{name_without_ext}_matched.json")
-        report_file = os.path.join(output_dir, f"{name_without_ext}_report.json")
+    with ProcessPoolExecutor(
+        max_workers=min(max_workers or os.cpu_count(), len(json_files)),
+        initializer=_worker_init,
+        initargs=(csv_file, standard_shop_names, lev_threshold, jw_threshold)
+    ) as executor:
+        futures = {
+            executor.submit(_worker_process, json_file, output_dir): index
+            for index, json_file in enumerate(json_files)
+        }
         
-        print(f"\n处理文件: {filename}")
-        
-        try:
-            # 处理单个文件
-            matcher.process_json_file(
-                input_json_file=json_file,
-                output_json_file=output_file,
-                report_file=report_file
-            )
+        for future in as_completed(futures):
+            index = futures[future]
+            filename = os.path.basename(json_files[index])
+            
+            print(f"\n处理文件: {filename}")
             
-            # 读取报告并统计
-            with open(report_file, 'r', encoding='utf-8') as f:
-                report = json.load(f)
+            try:
+                output_file, report_file = future.result()
+                
+                # 读取报告并统计
+                report = load_json_file(report_file)
                 file_replacements = report['summary']['total_replacements']
                 total_replacements += file_replacements
                 
@@ -74,12 +116,15 @@ def batch_process_files(input_dir: str, output_dir: str, csv_file: str,
                     'output_file': os.path.basename(output_file)
                 }
                 
-                all_reports.append(report)
+                reports[index] = report
                 
                 print(f"  替换数量: {file_replacements}")
-        
-        except Exception as e:
-            print(f"  处理失败: {e}")
+            
+            except Exception as e:
+                print(f"  处理失败: {e}")
+    
+    # 按文件顺序汇总报告
+    all_reports = [report for report in reports if report is not None]
     
     # 生成汇总报告
     summary_report = {
@@ -93,8 +138,7 @@ def batch_process_files(input_dir: str, output_dir: str, csv_file: str,
     }
     
     summary_file = os.path.join(output_dir, "batch_summary_report.json")
-    with open(summary_file, 'w', encoding='utf-8') as f:
-        json.dump(summary_report, f, ensure_ascii=False, indent=2)
+    dump_json_file(summary_report, summary_file)
     
     print(f"\n批量处理完成！")
     print(f"总文件数: {len(json_files)}")
@@ -109,6 +153,7 @@ def main():
     parser.add_argument('--csv', '-c', default='standard_shop_name.csv', help='标准店铺名称CSV文件路径')
     parser.add_argument('--lev-threshold', type=float, default=0.8, help='Levenshtein相似度阈值')
     parser.add_argument('--jw-threshold', type=float, default=0.85, help='Jaro-Winkler相似度阈值')
+    parser.add_argument('--workers', '-w', type=int, help='并行处理的工作进程数 (默认: CPU核心数)')
     
     args = parser.parse_args()
     
@@ -117,7 +162,8 @@ def main():
         output_dir=args.output_dir,
         csv_file=args.csv,
         lev_threshold=args.lev_threshold,
-        jw_threshold=args.jw_threshold
+        jw_threshold=args.jw_threshold,
+        max_workers=args.workers
     )
 
 if __name__ == "__main__":
@@ -2,21 +2,211 @@
 """
 Azure AI Content Understanding 店铺名称匹配器
 使用 Levenshtein 和 Jaro-Winkler 算法来匹配OCR识别的店铺名称与标准店铺名称
+相似度计算使用 rapidfuzz 的 C++ 实现
 """
 
-import json
+import copy
 import csv
-import textdistance
+import io
+import json
+import math
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from rapidfuzz import process
+from rapidfuzz.distance import JaroWinkler, Levenshtein
+from collections import OrderedDict, defaultdict
 from typing import Dict, List, Tuple, Optional, Any
 import argparse
 import logging
+import os
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时回退到标准库 json
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # 未安装 ijson 时整体读取JSON文件
+    ijson = None
 
 # 设置日志
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 需要匹配替换的店铺名称字段
+SHOP_NAME_FIELDS = ('shopname', 'shopname_in_search_bar')
+
+# 传给 rapidfuzz 的 score_cutoff 相对阈值的放宽量
+SCORE_CUTOFF_EPSILON = 1e-6
+
+# (OCR名称带SHEIN前缀, 标准名称带SHEIN前缀) -> 算法说明中的SHEIN标签，都不带前缀时为空
+SHEIN_SUFFIX_LABELS = {
+    (True, True): "SHEIN-suffix",
+    (True, False): "SHEIN-removed",
+    (False, True): "SHEIN-added",
+    (False, False): "",
+}
+
+# 并行处理顶层数组元素时，每个工作进程一次领取的元素数
+ITEM_CHUNK_SIZE = 64
+
+# 匹配结果缓存的最大条目数
+MATCH_CACHE_SIZE = 10000
+
+def load_json_file(path: str) -> Any:
+    """
+    读取JSON文件
+    
+    使用标准库 json 解析：超出64位的整数保持精确值，NaN/Infinity 也能读取
+    （orjson 的部分版本会把超大整数静默解析为浮点数）
+    
+    Args:
+        path: JSON文件路径
+        
+    Returns:
+        解析后的JSON数据
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def has_non_finite_float(data: Any) -> bool:
+    """
+    检查数据中是否含有 NaN/Infinity（orjson 会把它们写成 null）
+    
+    Args:
+        data: JSON数据
+        
+    Returns:
+        含有 NaN/Infinity 时返回True
+    """
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, float):
+            if not math.isfinite(value):
+                return True
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+    return False
+
+def dumps_json(data: Any) -> bytes:
+    """
+    以缩进格式序列化JSON数据（优先使用 orjson，保留非ASCII字符）
+    
+    含有 NaN/Infinity 或 orjson 无法序列化的内容（如超出64位的整数）时改用标准库 json，
+    保证这些数值原样写出；使用 orjson 时科学计数法的浮点数写作 1.5e-7、1e300（json 写作 1.5e-07、1e+300）
+    
+    Args:
+        data: 要序列化的JSON数据
+        
+    Returns:
+        UTF-8 编码的JSON字节串
+    """
+    if orjson is not None and not has_non_finite_float(data):
+        try:
+            return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+
+def dump_json_file(data: Any, path: str) -> None:
+    """
+    以缩进格式写入JSON文件（序列化规则见 dumps_json）
+    
+    Args:
+        data: 要写入的JSON数据
+        path: 输出文件路径
+    """
+    with open(path, 'wb') as file:
+        file.write(dumps_json(data))
+
+def load_standard_names(csv_file: str) -> List[str]:
+    """
+    从CSV文件加载标准店铺名称
+    
+    Args:
+        csv_file: CSV文件路径
+        
+    Returns:
+        标准店铺名称列表
+    """
+    try:
+        text = Path(csv_file).read_text(encoding='utf-8')
+        # 假设CSV文件只有一列，每行一个店铺名称；一次性读取后再用 csv.reader 解析，
+        # 与逐行读取文件时的换行和引号字段处理一致（不用 splitlines，它还会按 U+2028 等字符切分）
+        rows = csv.reader(io.StringIO(text, newline=''))
+        shop_names = [name for name in (row[0].strip() for row in rows if row) if name]  # 忽略空行
+    except Exception as e:
+        logger.error(f"读取CSV文件失败: {e}")
+        raise
+    
+    return shop_names
+
+def dumps_json_item(item: Any) -> bytes:
+    """
+    以缩进格式序列化顶层数组中的单个元素，缩进与 dump_json_file 输出的数组元素一致
+    
+    Args:
+        item: 顶层数组中的一个元素
+        
+    Returns:
+        UTF-8 编码的JSON字节串
+    """
+    data = dumps_json(item)
+    return b'  ' + data.replace(b'\n', b'\n  ')
+
+def is_json_array_file(path: str) -> bool:
+    """
+    判断JSON文件的顶层是否为数组（只读取开头的少量字节）
+    
+    Args:
+        path: JSON文件路径
+        
+    Returns:
+        顶层为数组时返回True
+    """
+    with open(path, 'rb') as file:
+        while True:
+            chunk = file.read(4096)
+            if not chunk:
+                return False
+            stripped = chunk.lstrip(b' \t\r\n\xef\xbb\xbf')
+            if stripped:
+                return stripped[:1] == b'['
+
+# 每个工作进程持有的匹配器实例（并行处理顶层数组元素时使用）
+_ITEM_MATCHER: Optional['ShopNameMatcher'] = None
+
+def _item_worker_init(matcher: 'ShopNameMatcher') -> None:
+    """
+    工作进程初始化：保存主进程传来的匹配器
+    
+    Args:
+        matcher: 已加载标准店铺名称的匹配器
+    """
+    global _ITEM_MATCHER
+    _ITEM_MATCHER = matcher
+
+def _item_worker_process(indexed_item: Tuple[int, Any]) -> Tuple[Any, List[Dict]]:
+    """
+    在工作进程中处理顶层数组的单个元素
+    
+    Args:
+        indexed_item: 元组 (元素下标, 元素)
+        
+    Returns:
+        元组 (处理后的元素, 替换记录列表)
+    """
+    item_index, item = indexed_item
+    return _ITEM_MATCHER._process_item(item, item_index, in_place=True)
+
 class ShopNameMatcher:
-    def __init__(self, csv_file: str, levenshtein_threshold: float = 0.8, jaro_winkler_threshold: float = 0.85):
+    def __init__(self, csv_file: str, levenshtein_threshold: float = 0.8, jaro_winkler_threshold: float = 0.85,
+                 standard_shop_names: Optional[List[str]] = None):
         """
         初始化店铺名称匹配器
         
@@ -24,42 +214,92 @@ class ShopNameMatcher:
             csv_file: 标准店铺名称CSV文件路径
             levenshtein_threshold: Levenshtein相似度阈值 (0-1)
             jaro_winkler_threshold: Jaro-Winkler相似度阈值 (0-1)
+            standard_shop_names: 已加载的标准店铺名称列表（可选，提供时不再读取CSV文件）
         """
         self.levenshtein_threshold = levenshtein_threshold
         self.jaro_winkler_threshold = jaro_winkler_threshold
-        self.standard_shop_names = self._load_standard_names(csv_file)
+        if standard_shop_names is None:
+            standard_shop_names = load_standard_names(csv_file)
+        self.standard_shop_names = standard_shop_names
         
-        # 初始化距离计算器
-        self.levenshtein = textdistance.levenshtein
-        self.jaro_winkler = textdistance.jaro_winkler
+        # 预先计算小写形式和SHEIN前缀信息，供批量相似度计算使用
+        # _std_suffix_or_lower: SHEIN前缀的标准名称取其后缀，其余取完整小写名称
+        self._std_lower = [name.lower() for name in self.standard_shop_names]
+        self._std_has_shein = np.array([name.startswith('shein ') for name in self._std_lower], dtype=bool)
+        self._std_suffix_or_lower = [
+            name[6:].strip() if has_shein else name
+            for name, has_shein in zip(self._std_lower, self._std_has_shein)
+        ]
+        self._shein_indices = np.flatnonzero(self._std_has_shein)
+        self._std_shein_suffixes = [self._std_suffix_or_lower[index] for index in self._shein_indices]
+        
+        # 按长度分组的 (下标列表, 小写名称列表)，用于单字符差异的短词匹配
+        self._by_len: Dict[int, Tuple[List[int], List[str]]] = defaultdict(lambda: ([], []))
+        for index, standard_name in enumerate(self.standard_shop_names):
+            indices, lowers = self._by_len[len(standard_name)]
+            indices.append(index)
+            lowers.append(self._std_lower[index])
+        self._by_len = dict(self._by_len)
+        
+        # 完全匹配用的哈希索引（名称重复时保留第一个，与按顺序扫描的结果一致）
+        self._std_set = set(self.standard_shop_names)
+        self._std_lower_to_orig: Dict[str, str] = {}
+        for standard_name, standard_lower in zip(self.standard_shop_names, self._std_lower):
+            self._std_lower_to_orig.setdefault(standard_lower, standard_name)
+        self._std_shein_suffix_to_orig: Dict[str, str] = {}
+        for index in self._shein_indices:
+            self._std_shein_suffix_to_orig.setdefault(self._std_suffix_or_lower[index], self.standard_shop_names[index])
+        
+        # 标准名称中出现过的全部字符（含小写形式），与之没有公共字符的字符串不可能匹配
+        self._standard_chars = set()
+        for standard_name in self.standard_shop_names:
+            self._standard_chars.update(standard_name)
+            self._standard_chars.update(standard_name.lower())
+        
+        # 缓存每个OCR字符串的匹配结果（包括未匹配的 None），同一店铺名称在文档中常重复出现
+        self._match_cache: OrderedDict = OrderedDict()
         
         logger.info(f"已加载 {len(self.standard_shop_names)} 个标准店铺名称")
         logger.info(f"Levenshtein阈值: {levenshtein_threshold}")
         logger.info(f"Jaro-Winkler阈值: {jaro_winkler_threshold}")
     
-    def _load_standard_names(self, csv_file: str) -> List[str]:
+    def _score_all(self, scorer: Any, threshold: float, ocr_name: str, ocr_name_lower: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
         """
-        从CSV文件加载标准店铺名称
+        使用 rapidfuzz.process.cdist 一次性计算OCR名称与所有标准名称的相似度
+        
+        阈值作为 score_cutoff 传入，rapidfuzz 会按长度差等条件提前排除不可能达到阈值的候选，
+        低于阈值的相似度记为0（不影响结果，因为未达到阈值的相似度不参与比较）
         
         Args:
-            csv_file: CSV文件路径
+            scorer: 相似度函数（Levenshtein.normalized_similarity 或 JaroWinkler.similarity）
+            threshold: 该算法的相似度阈值
+            ocr_name: OCR识别的店铺名称
+            ocr_name_lower: 小写形式的OCR名称
             
         Returns:
-            标准店铺名称列表
+            元组 (全名相似度, 大小写不敏感全名相似度, 加权后的SHEIN后缀相似度)，
+            没有SHEIN后缀比较的标准名称后缀相似度为0
         """
-        shop_names = []
-        try:
-            with open(csv_file, 'r', encoding='utf-8') as file:
-                # 假设CSV文件只有一列，每行一个店铺名称
-                reader = csv.reader(file)
-                for row in reader:
-                    if row and row[0].strip():  # 忽略空行
-                        shop_names.append(row[0].strip())
-        except Exception as e:
-            logger.error(f"读取CSV文件失败: {e}")
-            raise
+        def score(query: str, choices: List[str], weight: float = 1.0) -> np.ndarray:
+            # 加权比较的阈值换算回原始相似度，并略微放宽，避免浮点误差排除恰好等于阈值的边界值
+            score_cutoff = max(0.0, threshold / weight - SCORE_CUTOFF_EPSILON)
+            return process.cdist([query], choices, scorer=scorer, dtype=np.float64, workers=1, score_cutoff=score_cutoff)[0]
+        
+        full = score(ocr_name, self.standard_shop_names)
+        full_ci = score(ocr_name_lower, self._std_lower)
+        
+        if ocr_name_lower.startswith('shein '):
+            # 情况1：两者都以SHEIN开头，比较后缀（提高10%权重）
+            # 情况2：OCR以SHEIN开头，标准名称不以SHEIN开头，比较OCR后缀与完整标准名称（提高20%权重）
+            weights = np.where(self._std_has_shein, 1.1, 1.2)
+            suffix = np.minimum(1.0, score(ocr_name_lower[6:].strip(), self._std_suffix_or_lower, 1.2) * weights)
+        else:
+            # 情况3：OCR不以SHEIN开头，标准名称以SHEIN开头，比较完整OCR与标准名称后缀（提高15%权重）
+            suffix = np.zeros(len(self.standard_shop_names))
+            if len(self._shein_indices):
+                suffix[self._shein_indices] = np.minimum(1.0, score(ocr_name_lower, self._std_shein_suffixes, 1.15) * 1.15)
         
-        return shop_names
+        return full, full_ci, suffix
     
     def find_best_match(self, ocr_name: str) -> Optional[Tuple[str, float, str]]:
         """
@@ -75,184 +315,127 @@ class ShopNameMatcher:
             return None
         
         ocr_name = ocr_name.strip()
+        ocr_name_lower = ocr_name.lower()
+        
+        # 与所有标准名称都没有公共字符时（如纯中文、纯数字），各项相似度均为0，直接跳过
+        if self._standard_chars.isdisjoint(ocr_name) and self._standard_chars.isdisjoint(ocr_name_lower):
+            return None
+        
+        if ocr_name in self._match_cache:
+            self._match_cache.move_to_end(ocr_name)
+            return self._match_cache[ocr_name]
+        
+        result = self._match_uncached(ocr_name, ocr_name_lower)
+        self._match_cache[ocr_name] = result
+        if len(self._match_cache) > MATCH_CACHE_SIZE:
+            self._match_cache.popitem(last=False)
+        return result
+    
+    def _match_uncached(self, ocr_name: str, ocr_name_lower: str) -> Optional[Tuple[str, float, str]]:
+        """
+        在所有标准名称中查找最佳匹配（不使用缓存）
+        
+        Args:
+            ocr_name: 已去除首尾空白的OCR店铺名称
+            ocr_name_lower: 小写形式的OCR名称
+            
+        Returns:
+            元组 (匹配的标准名称, 相似度, 算法名称) 或 None
+        """
         best_match = None
         best_similarity = 0
         best_algorithm = ""
+        ocr_has_shein = ocr_name_lower.startswith('shein ')
         
         # 首先检查是否有完全匹配
-        if ocr_name in self.standard_shop_names:
+        if ocr_name in self._std_set:
             return None  # 完全匹配，无需替换
         
         # 检查是否是 SHEIN 的大小写变体，如果是则不进行处理
-        if ocr_name.lower() == 'shein':
+        if ocr_name_lower == 'shein':
             return None  # SHEIN 的任何大小写变体都不进行替换
         
         # 尝试大小写不敏感的完全匹配
-        ocr_name_lower = ocr_name.lower()
-        for standard_name in self.standard_shop_names:
-            if standard_name.lower() == ocr_name_lower:
-                return (standard_name, 1.0, "Case-insensitive exact match")
+        standard_name = self._std_lower_to_orig.get(ocr_name_lower)
+        if standard_name is not None:
+            return (standard_name, 1.0, "Case-insensitive exact match")
         
         # 特殊处理1：精确匹配 SHEIN GLOWMODE -> glowmode
         if ocr_name_lower == 'shein glowmode':
-            for standard_name in self.standard_shop_names:
-                if standard_name.lower() == 'glowmode':
-                    return (standard_name, 1.0, "Special case: SHEIN GLOWMODE -> glowmode")
+            standard_name = self._std_lower_to_orig.get('glowmode')
+            if standard_name is not None:
+                return (standard_name, 1.0, "Special case: SHEIN GLOWMODE -> glowmode")
         
         # 特殊处理2：精确匹配 Leisure -> SHEIN Leisure
         if ocr_name_lower == 'leisure':
-            for standard_name in self.standard_shop_names:
-                if standard_name.lower() == 'shein leisure':
-                    return (standard_name, 1.0, "Special case: Leisure -> SHEIN Leisure")
+            standard_name = self._std_lower_to_orig.get('shein leisure')
+            if standard_name is not None:
+                return (standard_name, 1.0, "Special case: Leisure -> SHEIN Leisure")
         
-        # 特殊处理3：如果OCR名称以SHEIN开头，尝试匹配不含SHEIN的部分
-        if ocr_name_lower.startswith('shein '):
-            # 去掉SHEIN前缀后的部分
-            ocr_suffix = ocr_name[6:].strip()
-            
-            # 检查这个后缀是否能完全匹配标准名称（大小写不敏感）
-            for standard_name in self.standard_shop_names:
-                if standard_name.lower() == ocr_suffix.lower():
-                    return (standard_name, 1.0, "SHEIN-prefix removed exact match")
+        # 特殊处理3：如果OCR名称以SHEIN开头，尝试匹配不含SHEIN的部分（大小写不敏感）
+        if ocr_has_shein:
+            standard_name = self._std_lower_to_orig.get(ocr_name[6:].strip().lower())
+            if standard_name is not None:
+                return (standard_name, 1.0, "SHEIN-prefix removed exact match")
         
         # 特殊处理4：如果OCR名称与某个标准名称的后缀完全匹配（大小写不敏感）
         # 例如: Leisure -> SHEIN Leisure
-        for standard_name in self.standard_shop_names:
-            standard_lower = standard_name.lower()
-            if standard_lower.startswith('shein '):
-                standard_suffix = standard_lower[6:].strip()
-                if standard_suffix == ocr_name_lower:
-                    return (standard_name, 1.0, "SHEIN-prefix added exact match")
+        standard_name = self._std_shein_suffix_to_orig.get(ocr_name_lower)
+        if standard_name is not None:
+            return (standard_name, 1.0, "SHEIN-prefix added exact match")
         
         # 特殊处理5：短词且只有一个字符不同的情况（如 Oazy/Dazy）
-        if len(ocr_name) <= 6:  # 只对短词应用此规则
-            for standard_name in self.standard_shop_names:
-                # 检查长度是否相同
-                if len(standard_name) == len(ocr_name):
-                    # 计算编辑距离（直接使用原始编辑距离，而不是相似度）
-                    edit_distance = self.levenshtein.distance(ocr_name_lower, standard_name.lower())
-                    # 如果只有一个字符不同
-                    if edit_distance == 1:
-                        # 计算常规相似度
-                        lev_similarity = self.levenshtein.normalized_similarity(ocr_name_lower, standard_name.lower())
-                        jw_similarity = self.jaro_winkler.normalized_similarity(ocr_name_lower, standard_name.lower())
-                        # 提高相似度权重
-                        lev_similarity = min(1.0, lev_similarity * 1.2)  # 提高20%权重
-                        jw_similarity = min(1.0, jw_similarity * 1.1)  # 提高10%权重
-                        
-                        # 选择更高的相似度
-                        similarity = max(lev_similarity, jw_similarity)
-                        if similarity > best_similarity:
-                            best_match = standard_name
-                            best_similarity = similarity
-                            best_algorithm = "Single-character difference"
-        
-        # 对所有标准名称计算相似度
-        for standard_name in self.standard_shop_names:
-            standard_lower = standard_name.lower()
-            
-            # 特殊处理：比较OCR名称与标准名称的SHEIN后缀
-            current_lev_similarity = 0
-            current_jw_similarity = 0
-            
-            # 情况1：两者都以SHEIN开头，比较后缀
-            if ocr_name_lower.startswith('shein ') and standard_lower.startswith('shein '):
-                ocr_suffix = ocr_name_lower[6:].strip()
-                standard_suffix = standard_lower[6:].strip()
-                
-                # 计算后缀之间的相似度
-                suffix_lev = self.levenshtein.normalized_similarity(ocr_suffix, standard_suffix)
-                suffix_jw = self.jaro_winkler.normalized_similarity(ocr_suffix, standard_suffix)
-                
-                # 提高后缀相似度匹配的权重
-                suffix_lev = min(1.0, suffix_lev * 1.1)  # 提高10%的权重，但不超过1.0
-                suffix_jw = min(1.0, suffix_jw * 1.1)
-                
-                if suffix_lev > current_lev_similarity:
-                    current_lev_similarity = suffix_lev
-                
-                if suffix_jw > current_jw_similarity:
-                    current_jw_similarity = suffix_jw
-            
-            # 情况2：OCR以SHEIN开头，标准名称不以SHEIN开头
-            elif ocr_name_lower.startswith('shein ') and not standard_lower.startswith('shein '):
-                ocr_suffix = ocr_name_lower[6:].strip()
-                
-                # 比较OCR的后缀与完整的标准名称
-                suffix_lev = self.levenshtein.normalized_similarity(ocr_suffix, standard_lower)
-                suffix_jw = self.jaro_winkler.normalized_similarity(ocr_suffix, standard_lower)
-                
-                # 提高从OCR名称移除SHEIN前缀后匹配的权重
-                suffix_lev = min(1.0, suffix_lev * 1.2)  # 提高20%的权重
-                suffix_jw = min(1.0, suffix_jw * 1.2)
-                
-                if suffix_lev > current_lev_similarity:
-                    current_lev_similarity = suffix_lev
-                
-                if suffix_jw > current_jw_similarity:
-                    current_jw_similarity = suffix_jw
-            
-            # 情况3：OCR不以SHEIN开头，标准名称以SHEIN开头
-            elif not ocr_name_lower.startswith('shein ') and standard_lower.startswith('shein '):
-                standard_suffix = standard_lower[6:].strip()
-                
-                # 比较完整的OCR与标准名称的后缀
-                suffix_lev = self.levenshtein.normalized_similarity(ocr_name_lower, standard_suffix)
-                suffix_jw = self.jaro_winkler.normalized_similarity(ocr_name_lower, standard_suffix)
-                
-                # 提高向OCR名称添加SHEIN前缀后匹配的权重
-                suffix_lev = min(1.0, suffix_lev * 1.15)  # 提高15%的权重
-                suffix_jw = min(1.0, suffix_jw * 1.15)
+        if len(ocr_name) <= 6 and len(ocr_name) in self._by_len:  # 只对短词应用此规则
+            # 在长度相同的标准名称中查找编辑距离为1的候选（大小写完全相同的已在前面返回）
+            indices, lowers = self._by_len[len(ocr_name)]
+            candidates = process.extract(ocr_name_lower, lowers, scorer=Levenshtein.distance, score_cutoff=1, limit=None)
+            for standard_lower, edit_distance, position in sorted(candidates, key=lambda candidate: candidate[2]):
+                if edit_distance != 1:
+                    continue
+                # 计算常规相似度
+                lev_similarity = Levenshtein.normalized_similarity(ocr_name_lower, standard_lower)
+                jw_similarity = JaroWinkler.similarity(ocr_name_lower, standard_lower)
+                # 提高相似度权重
+                lev_similarity = min(1.0, lev_similarity * 1.2)  # 提高20%权重
+                jw_similarity = min(1.0, jw_similarity * 1.1)  # 提高10%权重
                 
-                if suffix_lev > current_lev_similarity:
-                    current_lev_similarity = suffix_lev
-                
-                if suffix_jw > current_jw_similarity:
-                    current_jw_similarity = suffix_jw
-            
-            # 常规比较：全名比较（大小写敏感和不敏感）
-            lev_similarity = self.levenshtein.normalized_similarity(ocr_name, standard_name)
-            jw_similarity = self.jaro_winkler.normalized_similarity(ocr_name, standard_name)
-            
-            lev_similarity_ci = self.levenshtein.normalized_similarity(ocr_name.lower(), standard_name.lower())
-            jw_similarity_ci = self.jaro_winkler.normalized_similarity(ocr_name.lower(), standard_name.lower())
-            
-            # 使用大小写不敏感相似度的更高值
-            full_lev = max(lev_similarity, lev_similarity_ci)
-            full_jw = max(jw_similarity, jw_similarity_ci)
-            
-            if full_lev > current_lev_similarity:
-                current_lev_similarity = full_lev
+                # 选择更高的相似度
+                similarity = max(lev_similarity, jw_similarity)
+                if similarity > best_similarity:
+                    best_match = self.standard_shop_names[indices[position]]
+                    best_similarity = similarity
+                    best_algorithm = "Single-character difference"
+        
+        # 对所有标准名称批量计算相似度（全名、大小写不敏感全名、SHEIN后缀），取各比较方式中的最高值
+        lev_full, lev_full_ci, lev_suffix = self._score_all(Levenshtein.normalized_similarity, self.levenshtein_threshold, ocr_name, ocr_name_lower)
+        jw_full, jw_full_ci, jw_suffix = self._score_all(JaroWinkler.similarity, self.jaro_winkler_threshold, ocr_name, ocr_name_lower)
+        lev_scores = np.maximum(np.maximum(lev_full, lev_full_ci), lev_suffix)
+        jw_scores = np.maximum(np.maximum(jw_full, jw_full_ci), jw_suffix)
+        
+        # 未达到各自阈值的相似度不参与比较；相同相似度时保留排在前面的标准名称
+        lev_qualified = np.where(lev_scores >= self.levenshtein_threshold, lev_scores, -1.0)
+        jw_qualified = np.where(jw_scores >= self.jaro_winkler_threshold, jw_scores, -1.0)
+        final_scores = np.maximum(lev_qualified, jw_qualified)
+        index = int(np.argmax(final_scores))
+        
+        # 更新最佳匹配
+        if final_scores[index] > best_similarity:
+            best_match = self.standard_shop_names[index]
+            best_similarity = float(final_scores[index])
             
-            if full_jw > current_jw_similarity:
-                current_jw_similarity = full_jw
+            # 根据OCR名称和标准名称是否带SHEIN前缀查表得到算法说明
+            suffix_label = SHEIN_SUFFIX_LABELS[ocr_has_shein, bool(self._std_has_shein[index])]
             
-            # 更新最佳匹配
-            if current_lev_similarity >= self.levenshtein_threshold and current_lev_similarity > best_similarity:
-                best_match = standard_name
-                best_similarity = current_lev_similarity
-                
-                if ocr_name_lower.startswith('shein ') and standard_lower.startswith('shein '):
-                    best_algorithm = "Levenshtein (SHEIN-suffix)"
-                elif ocr_name_lower.startswith('shein ') and not standard_lower.startswith('shein '):
-                    best_algorithm = "Levenshtein (SHEIN-removed)"
-                elif not ocr_name_lower.startswith('shein ') and standard_lower.startswith('shein '):
-                    best_algorithm = "Levenshtein (SHEIN-added)"
+            if jw_qualified[index] > lev_qualified[index]:
+                if suffix_label:
+                    best_algorithm = f"Jaro-Winkler ({suffix_label})"
                 else:
-                    best_algorithm = "Levenshtein" if lev_similarity >= lev_similarity_ci else "Levenshtein (case-insensitive)"
-            
-            if current_jw_similarity >= self.jaro_winkler_threshold and current_jw_similarity > best_similarity:
-                best_match = standard_name
-                best_similarity = current_jw_similarity
-                
-                if ocr_name_lower.startswith('shein ') and standard_lower.startswith('shein '):
-                    best_algorithm = "Jaro-Winkler (SHEIN-suffix)"
-                elif ocr_name_lower.startswith('shein ') and not standard_lower.startswith('shein '):
-                    best_algorithm = "Jaro-Winkler (SHEIN-removed)"
-                elif not ocr_name_lower.startswith('shein ') and standard_lower.startswith('shein '):
-                    best_algorithm = "Jaro-Winkler (SHEIN-added)"
+                    best_algorithm = "Jaro-Winkler" if jw_full[index] >= jw_full_ci[index] else "Jaro-Winkler (case-insensitive)"
+            else:
+                if suffix_label:
+                    best_algorithm = f"Levenshtein ({suffix_label})"
                 else:
-                    best_algorithm = "Jaro-Winkler" if jw_similarity >= jw_similarity_ci else "Jaro-Winkler (case-insensitive)"
+                    best_algorithm = "Levenshtein" if lev_full[index] >= lev_full_ci[index] else "Levenshtein (case-insensitive)"
         
         if best_match:
             return (best_match, best_similarity, best_algorithm)
@@ -291,7 +474,7 @@ class ShopNameMatcher:
                     "similarity": similarity,
                     "algorithm": algorithm
                 })
-                logger.info(f"替换: '{original_name}' -> '{standard_name}' (相似度: {similarity:.3f}, 算法: {algorithm})")
+                logger.debug(f"替换: '{original_name}' -> '{standard_name}' (相似度: {similarity:.3f}, 算法: {algorithm})")
             else:
                 processed_names.append(original_name)
         
@@ -299,62 +482,140 @@ class ShopNameMatcher:
         processed_str = ', '.join(processed_names)
         return processed_str, replacement_records
     
-    def process_json_data(self, json_data: Any) -> Tuple[Any, List[Dict]]:
+    def _process_item(self, item: Any, item_index: int, in_place: bool) -> Tuple[Any, List[Dict]]:
+        """
+        处理顶层数组中的单个项目
+        
+        Args:
+            item: 顶层数组中的一个元素
+            item_index: 该元素在顶层数组中的下标（用于生成路径信息）
+            in_place: 是否直接修改传入的数据
+            
+        Returns:
+            元组 (处理后的项目, 替换记录列表)
+        """
+        def own(obj: Any) -> Any:
+            return obj if in_place else copy.copy(obj)
+        
+        replacement_records = []
+        
+        if not isinstance(item, dict) or 'result' not in item:
+            return item, replacement_records
+        result = item['result']
+        if not isinstance(result, dict) or not isinstance(result.get('contents'), list):
+            return item, replacement_records
+        
+        item = own(item)
+        result = item['result'] = own(result)
+        contents = result['contents'] = own(result['contents'])
+        for content_index, content in enumerate(contents):
+            if not isinstance(content, dict) or not isinstance(content.get('fields'), dict):
+                continue
+            content = contents[content_index] = own(content)
+            fields = content['fields'] = own(content['fields'])
+            
+            # 依次处理 shopname 和 shopname_in_search_bar 字段
+            for field_name in SHOP_NAME_FIELDS:
+                field = fields.get(field_name)
+                if not isinstance(field, dict) or 'valueString' not in field:
+                    continue
+                
+                processed_value, records = self.process_comma_separated_shop_names(field['valueString'])
+                field = fields[field_name] = own(field)
+                field['valueString'] = processed_value
+                
+                # 仅在发生替换时生成路径信息
+                for record in records:
+                    record['path'] = f"[{item_index}].result.contents[{content_index}].fields.{field_name}.valueString"
+                    record['field'] = field_name
+                    replacement_records.append(record)
+        
+        return item, replacement_records
+    
+    def process_json_data(self, json_data: Any, in_place: bool = False,
+                          max_workers: Optional[int] = None) -> Tuple[Any, List[Dict]]:
         """
         处理JSON数据，替换匹配的店铺名称
         专门处理 result.contents.fields.shopname.valueString 和 
         result.contents.fields.shopname_in_search_bar.valueString 字段
         
+        默认不修改原始数据：只浅拷贝通往店铺名称字段路径上的容器，其余部分与原始数据共享
+        
         Args:
             json_data: 原始JSON数据
+            in_place: 是否直接修改传入的数据
+            max_workers: 大于1时在进程池中并行处理顶层数组元素（各元素相互独立）
             
         Returns:
             元组 (处理后的JSON数据, 替换记录列表)
         """
-        processed_data = json.loads(json.dumps(json_data))  # 深拷贝
         replacement_records = []
         
         # 处理数组中的每个项目
-        if isinstance(processed_data, list):
-            for item_index, item in enumerate(processed_data):
-                if isinstance(item, dict) and 'result' in item:
-                    result = item['result']
-                    if isinstance(result, dict) and 'contents' in result:
-                        contents = result['contents']
-                        if isinstance(contents, list):
-                            for content_index, content in enumerate(contents):
-                                if isinstance(content, dict) and 'fields' in content:
-                                    fields = content['fields']
-                                    
-                                    # 处理 shopname 字段
-                                    if 'shopname' in fields and isinstance(fields['shopname'], dict):
-                                        if 'valueString' in fields['shopname']:
-                                            original_value = fields['shopname']['valueString']
-                                            processed_value, records = self.process_comma_separated_shop_names(original_value)
-                                            fields['shopname']['valueString'] = processed_value
-                                            
-                                            # 添加路径信息到记录
-                                            for record in records:
-                                                record['path'] = f"[{item_index}].result.contents[{content_index}].fields.shopname.valueString"
-                                                record['field'] = 'shopname'
-                                                replacement_records.append(record)
-                                    
-                                    # 处理 shopname_in_search_bar 字段
-                                    if 'shopname_in_search_bar' in fields and isinstance(fields['shopname_in_search_bar'], dict):
-                                        if 'valueString' in fields['shopname_in_search_bar']:
-                                            original_value = fields['shopname_in_search_bar']['valueString']
-                                            processed_value, records = self.process_comma_separated_shop_names(original_value)
-                                            fields['shopname_in_search_bar']['valueString'] = processed_value
-                                            
-                                            # 添加路径信息到记录
-                                            for record in records:
-                                                record['path'] = f"[{item_index}].result.contents[{content_index}].fields.shopname_in_search_bar.valueString"
-                                                record['field'] = 'shopname_in_search_bar'
-                                                replacement_records.append(record)
+        if not isinstance(json_data, list):
+            return json_data, replacement_records
+        
+        processed_data = json_data if in_place else copy.copy(json_data)
+        
+        if max_workers is not None and max_workers > 1 and len(processed_data) > 1:
+            # 元素在工作进程中处理后以副本形式返回，原始元素不会被修改
+            with ProcessPoolExecutor(
+                max_workers=max_workers,
+                initializer=_item_worker_init,
+                initargs=(self,)
+            ) as executor:
+                results = executor.map(_item_worker_process, enumerate(processed_data), chunksize=ITEM_CHUNK_SIZE)
+                for item_index, (item, records) in enumerate(results):
+                    processed_data[item_index] = item
+                    replacement_records.extend(records)
+            return processed_data, replacement_records
+        
+        for item_index, item in enumerate(processed_data):
+            processed_data[item_index], records = self._process_item(item, item_index, in_place)
+            replacement_records.extend(records)
         
         return processed_data, replacement_records
     
-    def process_json_file(self, input_json_file: str, output_json_file: str, report_file: Optional[str] = None) -> None:
+    def _stream_json_array(self, input_json_file: str, output_json_file: str) -> List[Dict]:
+        """
+        使用 ijson 逐个读取顶层数组元素，处理后立即写入输出文件
+        
+        Args:
+            input_json_file: 输入JSON文件路径（顶层为数组）
+            output_json_file: 输出JSON文件路径
+            
+        Returns:
+            替换记录列表
+        """
+        replacement_records = []
+        
+        logger.info(f"流式读取原始JSON文件: {input_json_file}")
+        
+        # 先写入同目录下的临时文件，全部完成后再替换输出文件；
+        # 输入与输出为同一文件时不会在读取过程中被截断，中途失败也不会留下写了一半的输出文件
+        temp_file = f"{output_json_file}.{os.getpid()}.tmp"
+        try:
+            with open(input_json_file, 'rb') as input_file, open(temp_file, 'wb') as output_file:
+                item_count = 0
+                for item in ijson.items(input_file, 'item', use_float=True):
+                    # 每个元素都是新解析出来的，直接原地修改
+                    item, records = self._process_item(item, item_count, in_place=True)
+                    replacement_records.extend(records)
+                    
+                    output_file.write(b'[\n' if item_count == 0 else b',\n')
+                    output_file.write(dumps_json_item(item))
+                    item_count += 1
+                
+                output_file.write(b'\n]' if item_count else b'[]')
+            os.replace(temp_file, output_json_file)
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+        
+        return replacement_records
+    
+    def process_json_file(self, input_json_file: str, output_json_file: str, report_file: Optional[str] = None,
+                          max_workers: Optional[int] = None) -> None:
         """
         处理JSON文件
         
@@ -362,20 +623,30 @@ class ShopNameMatcher:
             input_json_file: 输入JSON文件路径
             output_json_file: 输出JSON文件路径
             report_file: 替换报告文件路径（可选）
+            max_workers: 大于1时整体读取文件并在进程池中并行处理顶层数组元素
         """
         try:
-            # 读取原始JSON文件
-            with open(input_json_file, 'r', encoding='utf-8') as file:
-                original_data = json.load(file)
-            
-            logger.info(f"已读取原始JSON文件: {input_json_file}")
+            parallel = max_workers is not None and max_workers > 1
+            replacement_records = None
+            if ijson is not None and not parallel and is_json_array_file(input_json_file):
+                # 顶层为数组时逐个元素流式解析、处理并写出，内存占用与文件大小无关
+                try:
+                    replacement_records = self._stream_json_array(input_json_file, output_json_file)
+                except ijson.common.JSONError as e:
+                    # ijson 无法解析的内容（如超出int64的整数）改为整体读取后处理
+                    logger.warning(f"流式解析失败，改为整体读取: {e}")
             
-            # 处理数据
-            processed_data, replacement_records = self.process_json_data(original_data)
-            
-            # 写入处理后的JSON文件
-            with open(output_json_file, 'w', encoding='utf-8') as file:
-                json.dump(processed_data, file, ensure_ascii=False, indent=2)
+            if replacement_records is None:
+                # 读取原始JSON文件
+                original_data = load_json_file(input_json_file)
+                
+                logger.info(f"已读取原始JSON文件: {input_json_file}")
+                
+                # 处理数据（数据刚从文件读取，直接原地修改，无需深拷贝）
+                processed_data, replacement_records = self.process_json_data(original_data, in_place=True, max_workers=max_workers)
+                
+                # 写入处理后的JSON文件
+                dump_json_file(processed_data, output_json_file)
             
             logger.info(f"已写入处理后的JSON文件: {output_json_file}")
             logger.info(f"总共替换了 {len(replacement_records)} 个店铺名称")
@@ -390,16 +661,15 @@ class ShopNameMatcher:
                         field_stats[field] = 0
                     field_stats[field] += 1
                 
-                with open(report_file, 'w', encoding='utf-8') as file:
-                    json.dump({
-                        "summary": {
-                            "total_replacements": len(replacement_records),
-                            "field_statistics": field_stats,
-                            "levenshtein_threshold": self.levenshtein_threshold,
-                            "jaro_winkler_threshold": self.jaro_winkler_threshold
-                        },
-                        "replacements": replacement_records
-                    }, file, ensure_ascii=False, indent=2)
+                dump_json_file({
+                    "summary": {
+                        "total_replacements": len(replacement_records),
+                        "field_statistics": field_stats,
+                        "levenshtein_threshold": self.levenshtein_threshold,
+                        "jaro_winkler_threshold": self.jaro_winkler_threshold
+                    },
+                    "replacements": replacement_records
+                }, report_file)
                 
                 logger.info(f"已生成替换报告: {report_file}")
         
@@ -416,6 +686,7 @@ def main():
     parser.add_argument('--report', '-r', help='替换报告文件路径')
     parser.add_argument('--lev-threshold', type=float, default=0.8, help='Levenshtein相似度阈值 (默认: 0.8)')
     parser.add_argument('--jw-threshold', type=float, default=0.85, help='Jaro-Winkler相似度阈值 (默认: 0.85)')
+    parser.add_argument('--workers', '-w', type=int, help='并行处理顶层数组元素的工作进程数 (默认: 不并行)')
     
     args = parser.parse_args()
     
@@ -430,7 +701,8 @@ def main():
     matcher.process_json_file(
         input_json_file=args.input,
         output_json_file=args.output,
-        report_file=args.report
+        report_file=args.report,
+        max_workers=args.workers
     )
 
 if __name__ == "__main__":
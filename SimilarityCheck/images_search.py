@@ -1,98 +1,186 @@
 import os
+import functools
+import json
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import List
 from datetime import datetime, timedelta, timezone
 from azure.storage.blob import generate_blob_sas, BlobSasPermissions
 from urllib.parse import quote
 from dotenv import load_dotenv
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import orjson
+except ImportError:  # without orjson the search body is encoded with the standard json module
+    orjson = None
+
+try:
+    import faiss
+except ImportError:  # the local index is optional, without faiss every query goes to Azure
+    faiss = None
+
 load_dotenv()
 
-# Convert an image to vector
+# Max number of query images vectorized and searched at the same time
+CONCURRENCY = int(os.getenv("CONCURRENCY", "16"))
+
+# Endpoints, headers and query settings are read from the environment once at import
+VISION_API = f"{os.getenv('VISION_ENDPOINT')}/computervision/retrieval:vectorizeImage"
+VISION_HEADERS = {
+    "Ocp-Apim-Subscription-Key": os.getenv("VISION_KEY"),
+    "Content-Type": "application/octet-stream",
+}
+VISION_PARAMS = {"api-version": os.getenv("API_VISION"), "model-version": os.getenv("MODEL_VERSION")}
+SEARCH_URL = (
+    f"https://{os.getenv('SEARCH_SERVICE')}.search.windows.net/"
+    f"indexes/{os.getenv('SEARCH_INDEX')}/docs/search?api-version={os.getenv('API_SEARCH')}"
+)
+SEARCH_HEADERS = {
+    "Content-Type": "application/json",
+    "api-key": os.getenv("SEARCH_ADMIN_KEY"),
+}
+VECTOR_FIELD = os.getenv("VECTOR_FIELD")
+TOP_K = int(os.getenv("TOP_K", "3"))
+CONTAINER_NAME = os.getenv("CONTAINER_NAME")
+
+# Optional local FAISS index exported from the Azure index, with a JSON list of titles in vector id order
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH")
+LOCAL_TITLES_PATH = os.getenv("LOCAL_TITLES_PATH")
+
+# Account name and key parsed once from the storage connection string
+_STORAGE_SETTINGS = dict(
+    part.split("=", 1) for part in os.getenv("STORAGE_CONNECTION_STRING", "").split(";") if "=" in part
+)
+STORAGE_ACCOUNT_NAME = _STORAGE_SETTINGS.get("AccountName")
+STORAGE_ACCOUNT_KEY = _STORAGE_SETTINGS.get("AccountKey")
+
+# A generated SAS url is reused for at most this many seconds, so it keeps nearly its full validity
+SAS_REUSE_SECONDS = 60
+
+# Shared session so repeated calls reuse TCP/TLS connections; both POSTs are read-only, so retry them on throttling and server errors
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=None,
+        raise_on_status=False,
+    ),
+))
+
+# Load the local index and titles once, returns (None, None) when not configured
+def load_local_index():
+    if faiss is None or not LOCAL_INDEX_PATH or not LOCAL_TITLES_PATH:
+        return None, None
+    with open(LOCAL_TITLES_PATH, "r", encoding="utf-8") as f:
+        titles = json.load(f)
+    return faiss.read_index(LOCAL_INDEX_PATH), titles
+
+LOCAL_INDEX, LOCAL_TITLES = load_local_index()
+
+# Convert an image to vector; the file object is streamed as the request body instead of being read into memory first
 def vectorize_image(image_path: str) -> List[float]:
-    api = f"{os.getenv('VISION_ENDPOINT')}/computervision/retrieval:vectorizeImage"  
     with open(image_path, "rb") as f:
-        image_data = f.read()
-    headers = {
-        "Ocp-Apim-Subscription-Key": os.getenv("VISION_KEY"),
-        "Content-Type": "application/octet-stream",
-    }
-    params = {"api-version": os.getenv("API_VISION"), "model-version": os.getenv("MODEL_VERSION")}
-    resp = requests.post(
-        api,
-        params=params,
-        headers=headers,
-        data=image_data,
-        timeout=30,
-    )
+        resp = SESSION.post(
+            VISION_API,
+            params=VISION_PARAMS,
+            headers=VISION_HEADERS,
+            data=f,
+            timeout=30,
+        )
     resp.raise_for_status()
     vec = resp.json()["vector"]
     if len(vec) != 1024:
         raise ValueError("Vector dimension is not 1024, model and index mismatch")
     return vec
 
-# Search for similar images through vector similarity
+# Search for similar images in the local index, ids of -1 mean the index returned fewer than TOP_K hits
+def search_local(vec: List[float]) -> list:
+    scores, ids = LOCAL_INDEX.search(np.asarray([vec], dtype=np.float32), TOP_K)
+    return [
+        {"@search.score": float(score), "title": LOCAL_TITLES[doc_id]}
+        for score, doc_id in zip(scores[0], ids[0])
+        if doc_id >= 0
+    ]
+
+# Search for similar images through vector similarity, using the local index first when one is loaded
 def search_similar(vec: List[float]) -> list:
-    url = (
-        f"https://{os.getenv('SEARCH_SERVICE')}.search.windows.net/"
-        f"indexes/{os.getenv('SEARCH_INDEX')}/docs/search?api-version={os.getenv('API_SEARCH')}"
-    )
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": os.getenv("SEARCH_ADMIN_KEY"),
-    }
+    if LOCAL_INDEX is not None:
+        results = search_local(vec)
+        if results:
+            return results
     body = {
         "vectorQueries": [
             {
                 "kind": "vector",
                 "vector": vec,
-                "fields": os.getenv("VECTOR_FIELD"),
-                "k": int(os.getenv("TOP_K", "3")),
+                "fields": VECTOR_FIELD,
+                "k": TOP_K,
             }
         ],
         "select": "title"
     }
-    resp = requests.post(url, headers=headers, json=body, timeout=30)
+    # Vector fields are stored in single precision, so writing the query at float32 precision loses nothing and roughly halves the body
+    if orjson is not None and np is not None:
+        body["vectorQueries"][0]["vector"] = np.asarray(vec, dtype=np.float32)
+        data = orjson.dumps(body, option=orjson.OPT_SERIALIZE_NUMPY)
+    else:
+        data = json.dumps(body, separators=(",", ":")).encode("utf-8")
+    resp = SESSION.post(SEARCH_URL, headers=SEARCH_HEADERS, data=data, timeout=30)
     resp.raise_for_status()
     return resp.json()["value"]
 
-# Generate url for images in blob
+# Vectorize and search several query images concurrently, results are returned in input order
+def search_images(image_paths: List[str]) -> List[list]:
+    with ThreadPoolExecutor(max_workers=max(1, min(CONCURRENCY, len(image_paths)))) as executor:
+        return list(executor.map(lambda image_path: search_similar(vectorize_image(image_path)), image_paths))
+
+# Generate url for images in blob; the same blob within one reuse window gets the cached url
 def generate_blob_url(blob_name: str, expiry_hours: int = 1) -> str:
-    parts = os.getenv("STORAGE_CONNECTION_STRING").split(';')
-    account_name = None
-    account_key = None
-    for part in parts:
-        if part.startswith('AccountName='):
-            account_name = part.split('=', 1)[1]
-        elif part.startswith('AccountKey='):
-            account_key = part.split('=', 1)[1]
+    now = datetime.now(timezone.utc)
+    return _generate_blob_url(blob_name, expiry_hours, int(now.timestamp()) // SAS_REUSE_SECONDS)
+
+@functools.lru_cache(maxsize=1024)
+def _generate_blob_url(blob_name: str, expiry_hours: int, reuse_window: int) -> str:
     expiry = datetime.now(timezone.utc) + timedelta(hours=expiry_hours)
     sas_token = generate_blob_sas(
-        account_name=account_name,
-        container_name=os.getenv("CONTAINER_NAME"),
+        account_name=STORAGE_ACCOUNT_NAME,
+        container_name=CONTAINER_NAME,
         blob_name=blob_name,
-        account_key=account_key,
+        account_key=STORAGE_ACCOUNT_KEY,
         permission=BlobSasPermissions(read=True),
         expiry=expiry
     )
     encoded_blob_name = quote(blob_name, safe='')
-    base_url = f"https://{account_name}.blob.core.windows.net/{os.getenv('CONTAINER_NAME')}/{encoded_blob_name}"
+    base_url = f"https://{STORAGE_ACCOUNT_NAME}.blob.core.windows.net/{CONTAINER_NAME}/{encoded_blob_name}"
     return f"{base_url}?{sas_token}"
 
 # Main function
 if __name__ == "__main__":
     try:
-        qvec = vectorize_image(os.getenv("QUERY_IMAGE_PATH"))
-        results = search_similar(qvec)
-        print(f"\nTop {int(os.getenv('TOP_K', '3'))} matches")
-        for i, doc in enumerate(results, 1):
-            score = doc["@search.score"]
-            title = doc.get("title", "[no title]")
-            image_url = generate_blob_url(title)
-            print(f"{i:>2}. score={score:.3f}")
-            print(f"    title: {title}")
-            print(f"    url: {image_url}")
-            print()
+        query_paths = [path.strip() for path in os.getenv("QUERY_IMAGE_PATH").split(",") if path.strip()]
+        for query_path, results in zip(query_paths, search_images(query_paths)):
+            if len(query_paths) > 1:
+                print(f"\nQuery: {query_path}")
+            print(f"\nTop {TOP_K} matches")
+            for i, doc in enumerate(results, 1):
+                score = doc["@search.score"]
+                title = doc.get("title", "[no title]")
+                image_url = generate_blob_url(title)
+                print(f"{i:>2}. score={score:.3f}")
+                print(f"    title: {title}")
+                print(f"    url: {image_url}")
+                print()
     except requests.HTTPError as e:
         print("HTTP error:", e.response.status_code)
         print(e.response.text)